@@ -1,15 +1,20 @@
 from http import HTTPStatus
 
 import flask
+from google.api_core.exceptions import NotFound
 from google.cloud import firestore
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
 from menu import (
     DEVICE_COLLECTION,
     DeserializationError,
     Device,
     FirestoreError,
+    device_doc_id,
+    internal_server_error_response,
+    json_response,
     path_to_device,
+    request_json,
 )
 
 
@@ -17,116 +22,75 @@ class AddressPayload(BaseModel):
     address: str
 
 
+_ADDRESS_ADAPTER = TypeAdapter(AddressPayload)
+
+
 def get_address(request: flask.Request, db: firestore.Client) -> flask.Response:
     try:
-        path = request.path.removeprefix("/address")
-        device = path_to_device(path)
+        device = path_to_device(request.path.removeprefix("/address"))
         transaction = db.transaction()
         address = _get_address_transaction(transaction, db, device)
-        return flask.jsonify({"address": address})
+        return json_response({"address": address})
     except (ValueError, DeserializationError) as e:
-        response = flask.jsonify({"error": f"Bad Request: {e}"})
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+        return json_response({"error": f"Bad Request: {e}"}, HTTPStatus.BAD_REQUEST)
     except FirestoreError as e:
-        response = flask.jsonify({"error": str(e)})
-        response.status_code = HTTPStatus.NOT_FOUND
-        return response
+        return json_response({"error": str(e)}, HTTPStatus.NOT_FOUND)
     except Exception as e:
         print(f"CRITICAL: An unexpected error occurred in get_address(): {e}")
-        response = flask.jsonify({"error": f"An internal server error occurred: {e}"})
-        response.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return response
+        return internal_server_error_response()
 
 
 @firestore.transactional
 def _get_address_transaction(transaction, db: firestore.Client, device: Device) -> str:
-    address_query = (
+    device_snapshot = (
         db.collection(DEVICE_COLLECTION)
-        .where(filter=firestore.FieldFilter("model", "==", device.model.value))
-        .where(filter=firestore.FieldFilter("serialNumber", "==", device.serial_number))
-        .limit(1)
+        .document(device_doc_id(device))
+        .get(transaction=transaction)
     )
-    # Pass the transaction to the stream for transactional reads
-    document_stream = address_query.stream(transaction=transaction)
-    documents = list(document_stream)
-
-    if len(documents) > 1:
-        # This case should ideally not happen with limit(1), but it's good practice
-        # to handle it as a server-side data integrity issue.
-        raise FirestoreError(
-            f"Multiple devices with this serial number exist: {device.model.value}-{device.serial_number}"
-        )
-    elif not documents:
+    # `to_dict()` is None exactly when the document doesn't exist.
+    data = device_snapshot.to_dict()
+    if data is None:
         raise FirestoreError(
             f"No document found with serial number {device.model.value}-{device.serial_number} in collection '{DEVICE_COLLECTION}'."
         )
 
-    document_snapshot = documents[0].to_dict()
-    if "address" in document_snapshot and document_snapshot.get("address"):
-        return document_snapshot.get("address")
-    else:
+    address = data.get("address")
+    if not address:
         raise FirestoreError(
             f"Device has no configured address: {device.model.value}-{device.serial_number}"
         )
+    return address
 
 
 def put_address(request: flask.Request, db: firestore.Client) -> flask.Response:
     try:
-        path = request.path.removeprefix("/address")
-        device = path_to_device(path)
+        device = path_to_device(request.path.removeprefix("/address"))
 
         # Validate incoming JSON
         try:
-            payload = AddressPayload.model_validate(request.get_json())
+            payload = _ADDRESS_ADAPTER.validate_python(request_json(request))
             address = payload.address
-        except (
-            ValidationError,
-            AttributeError,
-        ):  # AttributeError for request.get_json() being None
+        except (ValidationError, DeserializationError):
             raise DeserializationError(
-                "Invalid JSON body. Expected '{\"address\": \"...\"}'."
+                'Invalid JSON body. Expected \'{"address": "..."}\'.'
             )
 
-        transaction = db.transaction()
-        _put_address_transaction(transaction, db, device, address)
+        # update() requires the document to exist, so no read is needed: a missing
+        # device fails with NotFound. A lone write needs no transaction.
+        try:
+            db.collection(DEVICE_COLLECTION).document(device_doc_id(device)).update(
+                {"address": address}
+            )
+        except NotFound:
+            raise FirestoreError(
+                f"No document found with serial number {device.model.value}-{device.serial_number} in collection '{DEVICE_COLLECTION}'."
+            )
 
         return flask.make_response("Successfully updated address.", HTTPStatus.OK)
     except (ValueError, DeserializationError) as e:
-        response = flask.jsonify({"error": f"Bad Request: {e}"})
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+        return json_response({"error": f"Bad Request: {e}"}, HTTPStatus.BAD_REQUEST)
     except FirestoreError as e:
-        response = flask.jsonify({"error": str(e)})
-        response.status_code = HTTPStatus.NOT_FOUND
-        return response
+        return json_response({"error": str(e)}, HTTPStatus.NOT_FOUND)
     except Exception as e:
         print(f"CRITICAL: An unexpected error occurred in put_address(): {e}")
-        response = flask.jsonify({"error": f"An internal server error occurred: {e}"})
-        response.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return response
-
-
-@firestore.transactional
-def _put_address_transaction(
-    transaction, db: firestore.Client, device: Device, new_address: str
-):
-    device_query = (
-        db.collection(DEVICE_COLLECTION)
-        .where(filter=firestore.FieldFilter("model", "==", device.model.value))
-        .where(filter=firestore.FieldFilter("serialNumber", "==", device.serial_number))
-        .limit(1)
-    )
-    docs_stream = device_query.stream(transaction=transaction)
-    documents = list(docs_stream)
-    if len(documents) > 1:
-        raise FirestoreError(
-            f"Multiple devices with this serial number exist: {device.model.value}-{device.serial_number}"
-        )
-    elif not documents:
-        raise FirestoreError(
-            f"No document found with serial number {device.model.value}-{device.serial_number} in collection '{DEVICE_COLLECTION}'."
-        )
-    else:
-        document_ref = documents[0].reference
-        transaction.update(document_ref, {"address": new_address})
+        return internal_server_error_response()
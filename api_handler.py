@@ -1,50 +1,80 @@
+import logging
+import threading
+
 import flask
 from http import HTTPStatus
 
-from mypy.typeops import false_only
-from pydantic import ValidationError
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+from pydantic import TypeAdapter, ValidationError
 from menu import (
     CONFIG_COLLECTION,
+    COUNTER_COLLECTION,
     Config,
+    MODEL_BY_VALUE,
+    internal_server_error_response,
+    json_response,
     path_to_device,
+    query_for_device,
+    request_json,
     DeserializationError,
     FirestoreError,
     Model,
     DEVICE_COLLECTION,
     FirestoreDeviceDocument,
     Device,
+    device_doc_id,
 )
+from google.api_core.exceptions import AlreadyExists
 from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 
+logger = logging.getLogger(__name__)
 
-@firestore.transactional
-def _get_transaction(transaction, db: firestore.Client, device: Device) -> Config:
-    device_query = (
-        db.collection(DEVICE_COLLECTION)
-        .where(filter=firestore.FieldFilter("model", "==", device.model.value))
-        .where(filter=firestore.FieldFilter("serialNumber", "==", device.serial_number))
-    )
-    docs_stream = device_query.stream(transaction=transaction)
-    documents = list(docs_stream)
-    if len(documents) > 1:
-        raise FirestoreError(
-            f"Multiple devices with this serial number exist: {device.model.value}-{device.serial_number}"
-        )
-    if not documents:
-        raise FirestoreError(
-            f"No document found with serial number {device.model.value}-{device.serial_number} in collection '{DEVICE_COLLECTION}'."
-        )
+# A module-level adapter reuses Config's compiled validator on every request.
+_CONFIG_ADAPTER = TypeAdapter(Config)
+
+# Firestore accepts at most 30 values in an "in" filter.
+_SERIAL_NUMBER_BATCH_SIZE = 30
 
-    device_document = FirestoreDeviceDocument.model_validate(documents[0].to_dict())
-    config_doc_ref_str = device_document.to_config_ref()
-    config_doc_ref = db.collection(CONFIG_COLLECTION).document(config_doc_ref_str)
 
-    # Use transaction.get() for the second read
-    config_snapshot = config_doc_ref.get(transaction=transaction)
+# How long a device's config reference is trusted. A deleted device keeps resolving
+# (and GET/PUT keep reaching its config) for at most this long on a warm instance.
+_CONFIG_REF_TTL_SECONDS = 60
+
+
+@cached(
+    cache=TTLCache(maxsize=4096, ttl=_CONFIG_REF_TTL_SECONDS),
+    # Keyed on the device alone, so the cache never holds a reference to the client.
+    key=lambda db, device: hashkey(device),
+    lock=threading.Lock(),
+)
+def _resolve_config_ref(db: firestore.Client, device: Device) -> str:
+    """
+    Returns the ID of the config document a device points at.
+
+    A device's config reference never changes once post() has created it, so the
+    lookup is cached per process for `_CONFIG_REF_TTL_SECONDS`, which bounds how
+    long a deleted device is still served. Unknown devices raise and are never cached.
+    """
+    return query_for_device(device, db).to_config_ref()
+
+
+def _get_config(db: firestore.Client, device: Device) -> Config:
+    """
+    Reads a device's config document.
+
+    With the config ID cached this is a lone read, so it's sent as a plain get
+    rather than a transaction, which would add BeginTransaction and Commit round trips.
+    """
+    config_doc_ref_str = _resolve_config_ref(db, device)
+    config_snapshot = (
+        db.collection(CONFIG_COLLECTION).document(config_doc_ref_str).get()
+    )
     if not config_snapshot.exists:
         raise FirestoreError(f"Config document with ID {config_doc_ref_str} not found.")
 
-    return Config.model_validate(config_snapshot.to_dict())
+    return _CONFIG_ADAPTER.validate_python(config_snapshot.to_dict())
 
 
 def get(request: flask.Request, db: firestore.Client) -> flask.Response:
@@ -53,56 +83,30 @@ def get(request: flask.Request, db: firestore.Client) -> flask.Response:
     """
     try:
         device = path_to_device(request.path)
-        transaction = db.transaction()
-        config = _get_transaction(transaction, db, device)
-        print("CONFIG: ", config)
+        config = _get_config(db, device)
+        logger.debug("CONFIG: %r", config)
         # Use the new custom serializer for the client response
-        response = flask.jsonify(config.to_client_dict())
-        response.status_code = HTTPStatus.OK
-        return response
+        return json_response(config.to_client_dict(), HTTPStatus.OK)
     except (ValueError, DeserializationError) as e:
-        response = flask.jsonify({"error": f"Bad Request: {e}"})
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+        return json_response({"error": f"Bad Request: {e}"}, HTTPStatus.BAD_REQUEST)
     except FirestoreError as e:
-        response = flask.jsonify({"error": str(e)})
-        response.status_code = HTTPStatus.NOT_FOUND
-        return response
+        return json_response({"error": str(e)}, HTTPStatus.NOT_FOUND)
     except Exception as e:
         print(f"CRITICAL: An unexpected error occurred in get(): {e}")
-        response = flask.jsonify({"error": f"An internal server error occurred: {e}"})
-        response.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return response
+        return internal_server_error_response()
 
 
-@firestore.transactional
-def _put_transaction(
-    transaction, db: firestore.Client, device: Device, new_config: Config
-):
-    device_query = (
-        db.collection(DEVICE_COLLECTION)
-        .where(filter=firestore.FieldFilter("model", "==", device.model.value))
-        .where(filter=firestore.FieldFilter("serialNumber", "==", device.serial_number))
-    )
-    docs_stream = device_query.stream(transaction=transaction)
-    documents = list(docs_stream)
-
-    if len(documents) > 1:
-        raise FirestoreError(
-            f"Multiple devices with this serial number exist: {device.model.value}-{device.serial_number}"
-        )
-    if not documents:
-        raise FirestoreError(
-            f"No document found with serial number {device.model.value}-{device.serial_number} in collection '{DEVICE_COLLECTION}'."
-        )
+def _put_config(db: firestore.Client, device: Device, new_config: Config):
+    """
+    Overwrites a device's config document.
 
-    device_document = FirestoreDeviceDocument.model_validate(documents[0].to_dict())
+    With the config ID cached this is a lone write, so it's sent as a single commit
+    rather than a transaction, which would add a BeginTransaction round trip.
+    """
     config_doc_ref = db.collection(CONFIG_COLLECTION).document(
-        device_document.to_config_ref()
+        _resolve_config_ref(db, device)
     )
-
-    # Use transaction.set() for writes
-    transaction.set(config_doc_ref, new_config.model_dump(by_alias=True))
+    config_doc_ref.set(new_config.as_firestore_dict())
 
 
 def put(request: flask.Request, db: firestore.Client) -> flask.Response:
@@ -111,32 +115,74 @@ def put(request: flask.Request, db: firestore.Client) -> flask.Response:
     """
     try:
         device = path_to_device(request.path)
-        new_config = Config.model_validate(request.get_json())
+        new_config = _CONFIG_ADAPTER.validate_python(request_json(request))
 
-        transaction = db.transaction()
-        _put_transaction(transaction, db, device, new_config)
+        _put_config(db, device, new_config)
 
-        response = flask.jsonify(
+        return json_response(
             {
                 "message": f"Config for {device.model.value}-{device.serial_number} updated successfully."
-            }
+            },
+            HTTPStatus.OK,
         )
-        response.status_code = HTTPStatus.OK
-        return response
 
     except (ValueError, ValidationError, DeserializationError) as e:
-        response = flask.jsonify({"error": f"Bad Request: {e}"})
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+        return json_response({"error": f"Bad Request: {e}"}, HTTPStatus.BAD_REQUEST)
     except FirestoreError as e:
-        response = flask.jsonify({"error": str(e)})
-        response.status_code = HTTPStatus.NOT_FOUND
-        return response
+        return json_response({"error": str(e)}, HTTPStatus.NOT_FOUND)
     except Exception as e:
         print(f"CRITICAL: An unexpected error occurred in put(): {e}")
-        response = flask.jsonify({"error": f"An internal server error occurred: {e}"})
-        response.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return response
+        return internal_server_error_response()
+
+
+def _nth_serial_number(base_serial_number: str, index: int) -> str:
+    """
+    Returns the serial number handed out to the `index`-th device of a phidget/load
+    cell pair: `<base>`, then `<base>-0`, `<base>-1`, ...
+    """
+    if index == 0:
+        return base_serial_number
+    return f"{base_serial_number}-{index - 1}"
+
+
+def _seed_serial_count(
+    transaction, db: firestore.Client, base_serial_number: str
+) -> int:
+    """
+    Returns the counter value to start a phidget/load cell pair at: one past the
+    highest serial number already taken, checking up to `_SERIAL_NUMBER_BATCH_SIZE`
+    candidates with each "in" query until a batch comes back empty.
+
+    Starting past the highest (rather than at the first gap) keeps the counter from
+    later walking into serial numbers registered before a deleted one.
+
+    Only used to seed the pair's counter for devices registered before counters existed.
+    """
+    count = 0
+    start = 0
+    while True:
+        candidates = [
+            _nth_serial_number(base_serial_number, index)
+            for index in range(start, start + _SERIAL_NUMBER_BATCH_SIZE)
+        ]
+        device_query = (
+            db.collection(DEVICE_COLLECTION)
+            .where(filter=FieldFilter("serialNumber", "in", candidates))
+            .select(["serialNumber"])
+        )
+        taken = {
+            snapshot.get("serialNumber")
+            for snapshot in device_query.stream(transaction=transaction)
+        }
+        taken_indices = [
+            start + offset
+            for offset, candidate in enumerate(candidates)
+            if candidate in taken
+        ]
+        if not taken_indices:
+            return count
+        count = taken_indices[-1] + 1
+        start += _SERIAL_NUMBER_BATCH_SIZE
 
 
 @firestore.transactional
@@ -147,75 +193,79 @@ def _post_transaction(
     Creates a new config and a new device document within a transaction,
     preventing race conditions.
     """
-    serial_number = f"{new_config.phidget_id}-{new_config.load_cell_id}"
+    base_serial_number = f"{new_config.phidget_id}-{new_config.load_cell_id}"
+
+    # 1. Claim the next serial number from the pair's counter document
+    counter_doc_ref = db.collection(COUNTER_COLLECTION).document(base_serial_number)
+    counter_snapshot = counter_doc_ref.get(transaction=transaction)
+    if counter_snapshot.exists:
+        count = counter_snapshot.get("count")
+    else:
+        count = _seed_serial_count(transaction, db, base_serial_number)
 
-    most_recent_device_query = (
-        db.collection(DEVICE_COLLECTION)
-        .where(filter=firestore.FieldFilter("serialNumber", "==", serial_number))
+    new_device = Device(
+        model=model, serial_number=_nth_serial_number(base_serial_number, count)
+    )
+    new_device_doc_ref = db.collection(DEVICE_COLLECTION).document(
+        device_doc_id(new_device)
     )
-    most_recent_device_stream = most_recent_device_query.stream(transaction=transaction)
-    most_recent_device = list(most_recent_device_stream)
 
-    if len(most_recent_device) > 0:
-        serial_number_is_set = False
-    else:
-        serial_number_is_set = True
-    index = 0
-    while not serial_number_is_set:
-        new_serial_number = f"{serial_number}-{index}"
-        most_recent_device_query = db.collection(DEVICE_COLLECTION).where(
-            filter=firestore.FieldFilter("serialNumber", "==", new_serial_number)
+    # A stale counter (e.g. a device registered without it) would hand out a taken
+    # serial number, so re-probe past the highest one before claiming it.
+    if new_device_doc_ref.get(transaction=transaction).exists:
+        count = _seed_serial_count(transaction, db, base_serial_number)
+        new_device = Device(
+            model=model, serial_number=_nth_serial_number(base_serial_number, count)
         )
-        most_recent_device_stream = most_recent_device_query.stream(
-            transaction=transaction
+        new_device_doc_ref = db.collection(DEVICE_COLLECTION).document(
+            device_doc_id(new_device)
         )
-        most_recent_device = list(most_recent_device_stream)
-        if len(most_recent_device) > 0:
-            index += 1
-        else:
-            serial_number_is_set = True
-            serial_number = new_serial_number
-
 
+    transaction.set(counter_doc_ref, {"count": count + 1})
 
-    # 2. Create new config document
-    new_config = Config.model_validate(new_config)
-    new_config_doc_ref = db.collection(CONFIG_COLLECTION).document()
-    transaction.set(new_config_doc_ref, new_config.model_dump(by_alias=True))
+    # 2. Create new config document under the device's ID. `create` fails the
+    # commit if the ID is somehow taken, rather than overwriting an existing device.
+    new_config_doc_ref = db.collection(CONFIG_COLLECTION).document(
+        device_doc_id(new_device)
+    )
+    transaction.create(new_config_doc_ref, new_config.as_firestore_dict())
 
     # 3. Create new device document
     new_device_doc = FirestoreDeviceDocument.model_construct(
-        model=model, serial_number=serial_number, config=new_config_doc_ref.id
+        model=model,
+        serial_number=new_device.serial_number,
+        config=new_config_doc_ref.id,
     )
-    new_device_doc_ref = db.collection(DEVICE_COLLECTION).document()
-    transaction.set(new_device_doc_ref, new_device_doc.model_dump(by_alias=True))
+    transaction.create(new_device_doc_ref, new_device_doc.as_firestore_dict())
 
-    return new_device_doc.to_device()
+    return new_device
 
 
 def post(request: flask.Request, db: firestore.Client) -> flask.Response:
     try:
-        model_str = request.path.split("/")[-1]
-        model = Model[model_str]
-        new_config_data = Config.model_validate(request.get_json())
+        model_str = request.path.rpartition("/")[2]
+        model = MODEL_BY_VALUE.get(model_str)
+        if model is None:
+            return json_response(
+                {"error": f"Bad Request: Invalid model '{model_str}' in path."},
+                HTTPStatus.BAD_REQUEST,
+            )
+        new_config_data = _CONFIG_ADAPTER.validate_python(request_json(request))
 
         transaction = db.transaction()
         new_device = _post_transaction(transaction, db, model, new_config_data)
 
-        return flask.make_response(new_device.model_dump(), HTTPStatus.CREATED)
+        return json_response(new_device.model_dump(), HTTPStatus.CREATED)
     except (ValidationError, DeserializationError) as e:
-        response = flask.jsonify({"error": f"Bad Request: Invalid JSON body. {e}"})
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
-    except KeyError:
-        model_str = request.path.split("/")[-1]
-        response = flask.jsonify(
-            {"error": f"Bad Request: Invalid model '{model_str}' in path."}
+        return json_response(
+            {"error": f"Bad Request: Invalid JSON body. {e}"}, HTTPStatus.BAD_REQUEST
+        )
+    except AlreadyExists as e:
+        print(f"CRITICAL: Serial number counter collided with an existing device: {e}")
+        return json_response(
+            {"error": "Conflict: The allocated serial number is already in use."},
+            HTTPStatus.CONFLICT,
         )
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
     except Exception as e:
         print(f"CRITICAL: An unexpected error occurred in post(): {e}")
-        response = flask.jsonify({"error": f"An internal server error occurred: {e}"})
-        response.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return response
+        return internal_server_error_response()
@@ -0,0 +1,34 @@
+import flask
+import pytest
+from unittest.mock import MagicMock
+
+from api_handler import _resolve_config_ref
+
+# --- Shared Fixtures ---
+
+
+@pytest.fixture(scope="session")
+def app():
+    """A single Flask application shared by every test in the session."""
+    return flask.Flask(__name__)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def app_context(app):
+    """Pushes one application context for the whole session, so handlers can build Flask responses."""
+    with app.app_context():
+        yield
+
+
+@pytest.fixture
+def mock_db():
+    """Fixture for a mocked Firestore client, fresh for every test."""
+    return MagicMock()
+
+
+@pytest.fixture(autouse=True)
+def clear_config_ref_cache():
+    """Keeps config references cached by one test from leaking into the next."""
+    _resolve_config_ref.cache_clear()
+    yield
+    _resolve_config_ref.cache_clear()
@@ -1,6 +1,6 @@
 import os
 import hmac
-from typing import Tuple, Optional
+from typing import Callable, Tuple, Optional
 import flask
 import functions_framework
 from google.cloud import firestore
@@ -8,6 +8,37 @@ from google.cloud import firestore
 from address_api_handler import get_address, put_address
 from api_handler import get, put, post
 
+# AUTH_TOKEN is fixed for the life of the instance, so it's read once at import.
+_EXPECTED_TOKEN = (os.environ.get("AUTH_TOKEN") or "").encode("utf-8")
+
+# Route tables keyed by HTTP method; anything unlisted falls through to the greeting.
+_Handler = Callable[[flask.Request, firestore.Client], flask.Response]
+_HANDLERS: dict[str, _Handler] = {"GET": get, "POST": post, "PUT": put}
+_ADDRESS_HANDLERS: dict[str, _Handler] = {"GET": get_address, "PUT": put_address}
+
+# Created on first use and reused by every invocation on a warm instance.
+_DB: Optional[firestore.Client] = None
+
+
+def _get_db() -> firestore.Client:
+    """
+    Returns the process-wide Firestore client, creating it on the first call.
+
+    Reusing the client keeps its gRPC channel and credentials alive between
+    invocations instead of rebuilding them for every request.
+    """
+    global _DB
+    if _DB is None:
+        _DB = firestore.Client(project="back-of-house-backend", database="caldo-backend")  # type: ignore
+    return _DB
+
+
+# On a deployed instance, pay for the client, its credentials and gRPC stub
+# during cold start rather than on the first request. K_SERVICE is only set by
+# the Cloud Run / Cloud Functions runtime, so tests and local imports skip it.
+if os.environ.get("K_SERVICE"):
+    _get_db()._firestore_api
+
 
 def authenticate(request: flask.Request) -> Tuple[bool, Optional[Tuple[str, int]]]:
     """
@@ -23,11 +54,8 @@ def authenticate(request: flask.Request) -> Tuple[bool, Optional[Tuple[str, int]
         - (True, None) if authentication is successful.
         - (False, (error_message, status_code)) if authentication fails.
     """
-    # Get the secret token from environment variables for security.
-    expected_token = os.environ.get("AUTH_TOKEN")
-
     # 1. Check for server-side configuration issues.
-    if not expected_token:
+    if not _EXPECTED_TOKEN:
         print("CRITICAL: AUTH_TOKEN environment variable not set.\n")
         error = (
             "Internal Server Error: Server is not configured for authentication. \n",
@@ -41,15 +69,11 @@ def authenticate(request: flask.Request) -> Tuple[bool, Optional[Tuple[str, int]
         error = ("Unauthorized: Missing or invalid Authorization header.\n", 401)
         return False, error
 
-    # 3. Extract the token from the header.
-    try:
-        provided_token = auth_header.split("Bearer ")[1]
-    except IndexError:
-        error = ("Unauthorized: Malformed Authorization header.\n", 401)
-        return False, error
+    # 3. Extract the token from the header; the prefix was checked above.
+    provided_token = auth_header[len("Bearer ") :].encode("utf-8")
 
     # 4. Securely compare the provided token against the expected one.
-    if not hmac.compare_digest(provided_token, expected_token):
+    if not hmac.compare_digest(provided_token, _EXPECTED_TOKEN):
         error = ("Forbidden: Invalid token.\n", 403)
         return False, error
 
@@ -63,19 +87,13 @@ def mise(request: flask.Request) -> flask.Response:
     if not is_authenticated:
         return flask.make_response(error_response)
 
-    db = firestore.Client(project="back-of-house-backend", database="caldo-backend")  # type: ignore
+    db = _get_db()
 
     if request.path.split("/")[1] == "address":
-        if request.method == "GET":
-            return get_address(request, db)
-        elif request.method == "PUT":
-            return put_address(request, db)
+        handler = _ADDRESS_HANDLERS.get(request.method)
     else:
-        if request.method == "GET":
-            return get(request, db)
-        elif request.method == "POST":
-            return post(request, db)
-        elif request.method == "PUT":
-            return put(request, db)
+        handler = _HANDLERS.get(request.method)
+    if handler is not None:
+        return handler(request, db)
 
     return flask.make_response("Hello, Chef!")
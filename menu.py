@@ -1,11 +1,33 @@
+import functools
+import re
 from datetime import timedelta
 from enum import Enum
+from http import HTTPStatus
+
+import flask
+import orjson
 from google.cloud import firestore
-from pydantic import BaseModel, Field, field_serializer, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_serializer, field_validator
 from typing import Any
 
 DEVICE_COLLECTION = "devices"
 CONFIG_COLLECTION = "config"
+COUNTER_COLLECTION = "counters"
+
+# Unexpected errors are only detailed in the logs, so clients get a fixed body.
+_INTERNAL_SERVER_ERROR_BODY = orjson.dumps(
+    {"error": "An internal server error occurred."}
+)
+
+# `address` is a route prefix, not a model, so a path starting with it is malformed
+# here; the address handlers strip it before parsing.
+_PATH_RE = re.compile(r"^/?(?!address/)(?P<model>[^/]+)/(?P<serial>[^/]+)/?$")
+
+
+_DURATION_FIELDS = ("heartbeat_period", "phidget_sample_period")
+# `model_dump(exclude=...)` is typed to take a set (not a tuple or frozenset); the
+# tuple above keeps the output key order stable.
+_DURATION_FIELDS_EXCLUDE: set[str] = set(_DURATION_FIELDS)
 
 
 class Config(BaseModel):
@@ -41,25 +63,30 @@ class Config(BaseModel):
         """
         return td.total_seconds()
 
+    def as_firestore_dict(self) -> dict[str, Any]:
+        """
+        Serializes the model with Firestore's camelCase aliases, calling the
+        pydantic-core serializer directly rather than through `model_dump`.
+        """
+        return self.__pydantic_serializer__.to_python(self, by_alias=True)
+
     def to_client_dict(self) -> dict[str, Any]:
         """
         Serializes the model to a dictionary suitable for the Rust client.
         - Uses snake_case field names (no aliases).
         - Serializes timedelta fields to the `{"secs": ..., "nanos": ...}` format.
         """
-        # Get a base dictionary with snake_case keys.
-        # The default @field_serializer will run, but we'll overwrite its output.
-        data = self.model_dump(by_alias=False)
+        # Get a base dictionary with snake_case keys, leaving out the durations so
+        # the @field_serializer doesn't produce floats we'd only overwrite.
+        data = self.model_dump(by_alias=False, exclude=_DURATION_FIELDS_EXCLUDE)
 
-        # Manually re-serialize timedelta fields into the client's desired format.
-        for field_name in ["heartbeat_period", "phidget_sample_period"]:
+        # Serialize timedelta fields from their integer parts, avoiding float rounding.
+        for field_name in _DURATION_FIELDS:
             td_value: timedelta = getattr(self, field_name)
-
-            if td_value:
-                seconds = int(td_value.total_seconds())
-                # Calculate nanoseconds from the fractional part of total_seconds()
-                nanoseconds = int((td_value.total_seconds() - seconds) * 1_000_000_000)
-                data[field_name] = {"secs": seconds, "nanos": nanoseconds}
+            data[field_name] = {
+                "secs": td_value.days * 86_400 + td_value.seconds,
+                "nanos": td_value.microseconds * 1000,
+            }
 
         return data
 
@@ -73,27 +100,55 @@ class Model(str, Enum):
     LibraV0 = "LibraV0"
 
 
+# Dict lookup avoids Enum's metaclass call and the ValueError it raises on a miss.
+MODEL_BY_VALUE = {model.value: model for model in Model}
+
+
 class Device(BaseModel):
+    # Frozen so instances are hashable and can be shared from path_to_device's cache.
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     model: Model
     serial_number: str
 
 
 class FirestoreDeviceDocument(BaseModel):
+    # Not extra="forbid": device documents also carry the `address` field.
+    model_config = ConfigDict(frozen=True)
+
     model: Model
     serial_number: str = Field(alias="serialNumber")
     config: str
 
+    @classmethod
+    def from_trusted(cls, data: dict[str, Any]) -> "FirestoreDeviceDocument":
+        """
+        Builds the model from a document read out of Firestore, skipping validation.
+        Only the enum is resolved, since `model_construct` stores values as given.
+        """
+        return cls.model_construct(
+            model=MODEL_BY_VALUE[data["model"]],
+            serial_number=data["serialNumber"],
+            config=data["config"],
+        )
+
     def to_device(self) -> Device:
-        return Device.model_validate(self.model_dump())
+        return Device.model_construct(
+            model=self.model, serial_number=self.serial_number
+        )
 
     def to_config_ref(self) -> str:
         return self.config
 
+    def as_firestore_dict(self) -> dict[str, Any]:
+        return self.__pydantic_serializer__.to_python(self, by_alias=True)
+
 
 class DeserializationError(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=8192)
 def path_to_device(path: str) -> Device:
     """
     Parses a URL path like '/<model>/<number>' into a Device object.
@@ -101,37 +156,70 @@ def path_to_device(path: str) -> Device:
     Raises:
         ValueError: If the path format is incorrect or parts are invalid.
     """
-    path_parts = path.strip("/").split("/")
-    if len(path_parts) != 2:
+    match = _PATH_RE.match(path)
+    if match is None:
         raise ValueError(
             f"Invalid path format. Expected '/<model>/<serial-number>', but got '{path}'"
         )
-    model_str, serial_number = path_parts
+    model_str, serial_number = match.group("model", "serial")
 
-    try:
-        model = Model(model_str)
-    except ValueError:
+    model = MODEL_BY_VALUE.get(model_str)
+    if model is None:
         raise ValueError(f"Invalid model '{model_str}' in path.")
 
-    return Device(model=model, serial_number=serial_number)
+    # Both parts are already checked, so the Device can skip validation.
+    return Device.model_construct(model=model, serial_number=serial_number)
 
 
-def query_for_device(device: Device, db: firestore.Client) -> FirestoreDeviceDocument:
-    docs_stream = (
-        db.collection(DEVICE_COLLECTION)
-        .where(filter=firestore.FieldFilter("model", "==", device.model.value))
-        .where(filter=firestore.FieldFilter("number", "==", device.serial_number))
-        .stream()
+def device_doc_id(device: Device) -> str:
+    """
+    Returns the Firestore document ID a device is stored under, `<model>-<serial-number>`.
+    """
+    return f"{device.model.value}-{device.serial_number}"
+
+
+def request_json(request: flask.Request) -> Any:
+    """
+    Decodes the request body with orjson instead of Flask's stdlib-based `get_json()`.
+    The body is read once, so Flask is told not to keep a cached copy of it.
+
+    Raises:
+        DeserializationError: If the body is not valid JSON.
+    """
+    try:
+        return orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError as e:
+        raise DeserializationError(f"Invalid JSON body: {e}")
+
+
+def json_response(body: Any, status: int = HTTPStatus.OK) -> flask.Response:
+    """
+    Builds a JSON response encoded with orjson instead of `flask.jsonify`.
+    """
+    return flask.Response(
+        orjson.dumps(body), status=status, mimetype="application/json"
     )
-    documents = list(docs_stream)
-    if len(documents) > 1:
-        msg = f"Multiple devices with this serial number exist: {device.model.value}-{device.serial_number}"
-        raise (FirestoreError(msg))
-    elif len(documents) == 0:
+
+
+def internal_server_error_response() -> flask.Response:
+    """
+    Builds the generic 500 response around a body serialized once at import.
+    """
+    return flask.Response(
+        _INTERNAL_SERVER_ERROR_BODY,
+        status=HTTPStatus.INTERNAL_SERVER_ERROR,
+        mimetype="application/json",
+    )
+
+
+def query_for_device(device: Device, db: firestore.Client) -> FirestoreDeviceDocument:
+    snapshot = db.collection(DEVICE_COLLECTION).document(device_doc_id(device)).get()
+    # `to_dict()` is None exactly when the document doesn't exist.
+    data = snapshot.to_dict()
+    if data is None:
         msg = f"No document found with serial number {device.model.value}-{device.serial_number} in collection '{DEVICE_COLLECTION}'."
         raise (FirestoreError(msg))
-    else:
-        return FirestoreDeviceDocument.model_validate(documents[0].to_dict())
+    return FirestoreDeviceDocument.from_trusted(data)
 
 
 class FirestoreError(Exception):
@@ -0,0 +1,43 @@
+"""
+One-shot migration that moves device documents to deterministic document IDs.
+
+Devices used to be stored under auto-generated IDs and located with a
+`model`/`serialNumber` query. The handlers now address them directly by
+`menu.device_doc_id`, so every existing document has to be moved once before
+deploying:
+
+    python migrate_device_ids.py
+"""
+
+from google.cloud import firestore
+
+from menu import DEVICE_COLLECTION, FirestoreDeviceDocument, device_doc_id
+
+
+def migrate(db: firestore.Client) -> None:
+    collection = db.collection(DEVICE_COLLECTION)
+    for snapshot in collection.stream():
+        data = snapshot.to_dict()
+        if data is None:
+            print(f"WARNING: Skipping {snapshot.id}, it has no data.")
+            continue
+        device = FirestoreDeviceDocument.model_validate(data).to_device()
+        doc_id = device_doc_id(device)
+        if snapshot.id == doc_id:
+            continue
+
+        new_doc_ref = collection.document(doc_id)
+        if new_doc_ref.get().exists:
+            print(f"WARNING: Skipping {snapshot.id}, {doc_id} already exists.")
+            continue
+
+        # Copy and delete in one batch so a device is never stored twice.
+        batch = db.batch()
+        batch.set(new_doc_ref, data)
+        batch.delete(snapshot.reference)
+        batch.commit()
+        print(f"Moved {snapshot.id} -> {doc_id}")
+
+
+if __name__ == "__main__":
+    migrate(firestore.Client(project="back-of-house-backend", database="caldo-backend"))  # type: ignore
@@ -1,12 +1,29 @@
-import flask
+import time
+
+import orjson
 import pytest
-from unittest.mock import MagicMock, patch
+from cachetools.keys import hashkey
+from unittest.mock import ANY, MagicMock, Mock, patch
+from google.api_core.exceptions import AlreadyExists, NotFound
+from dataclasses import dataclass
 from http import HTTPStatus
-
-from api_handler import get, put, post, _post_transaction
+from typing import Optional
+from types import MappingProxyType
+
+from api_handler import (
+    _CONFIG_REF_TTL_SECONDS,
+    _get_config,
+    _post_transaction,
+    _put_config,
+    _resolve_config_ref,
+    get,
+    post,
+    put,
+)
 from address_api_handler import get_address, put_address, _get_address_transaction
 from menu import (
     CONFIG_COLLECTION,
+    COUNTER_COLLECTION,
     DEVICE_COLLECTION,
     Config,
     Device,
@@ -14,33 +31,9 @@ from menu import (
     Model,
 )
 
-# --- Fixtures ---
-
-
-@pytest.fixture
-def mock_db():
-    """Fixture for a mocked Firestore client."""
-    return MagicMock()
-
-
-@pytest.fixture
-def app_context():
-    """Fixture to create a Flask application context for tests that need it."""
-    app = flask.Flask(__name__)
-    with app.app_context():
-        yield
-
-
-@pytest.fixture
-def sample_device():
-    """A sample Device object for testing."""
-    return Device(model=Model.IchibuV1, serial_number="test-serial-123")
-
-
-@pytest.fixture
-def sample_config_data():
-    """A sample config data dictionary, as received from a client."""
-    return {
+# A sample config data mapping, as received from a client. Read-only, as it is shared.
+_BASE_CONFIG = MappingProxyType(
+    {
         "gain": 1.0,
         "ingredient": "coffee",
         "loadCellId": 12345,
@@ -52,33 +45,81 @@ def sample_config_data():
         "maxNoise": 0.01,
         "bufferLength": 10,
     }
+)
+
+# --- Fixtures ---
+
+
+@pytest.fixture(scope="session")
+def sample_device():
+    """A sample Device object for testing."""
+    return Device(model=Model.IchibuV1, serial_number="test-serial-123")
 
 
 @pytest.fixture
-def sample_config(sample_config_data):
+def config_data(request):
+    """Client config data: `_BASE_CONFIG` with any fields overridden via indirect parametrization."""
+    return {**_BASE_CONFIG, **getattr(request, "param", {})}
+
+
+@pytest.fixture(scope="session")
+def sample_config():
     """A sample Config Pydantic object."""
-    return Config.model_validate(sample_config_data)
+    return Config.model_validate(_BASE_CONFIG)
+
+
+@pytest.fixture
+def firestore_collections(mock_db):
+    """Wires `mock_db.collection(name)` to one mock per collection: (devices, configs, counters)."""
+    collections = {
+        DEVICE_COLLECTION: MagicMock(),
+        CONFIG_COLLECTION: MagicMock(),
+        COUNTER_COLLECTION: MagicMock(),
+    }
+    mock_db.collection.side_effect = collections.__getitem__
+    return tuple(collections.values())
 
 
 # --- Helper Functions ---
 
 
+@dataclass(slots=True)
+class _FakeRequest:
+    """The slice of flask.Request the handlers use, without MagicMock's spec introspection."""
+
+    path: str
+    method: str = "GET"
+    data: bytes = b"null"
+    cached: Optional[bool] = None
+
+    def get_data(self, cache: bool = True) -> bytes:
+        self.cached = cache
+        return self.data
+
+
 def create_mock_request(path, method="GET", json_data=None):
     """Helper to create a mock Flask request."""
-    req = MagicMock(spec=flask.Request)
-    req.path = path
-    req.method = method
-    req.get_json.return_value = json_data
-    return req
+    return _FakeRequest(path, method, orjson.dumps(json_data))
+
+
+def _doc_ref(collection):
+    """Returns the document reference every `collection.document(...)` call resolves to."""
+    return collection.document.return_value
+
+
+def _serial_number_query(collection):
+    """Returns the projected query `_seed_serial_count` builds on `collection`."""
+    return collection.where.return_value.select.return_value
 
 
 def create_mock_firestore_doc(data, doc_id="some-doc-id"):
-    """Helper to create a mock Firestore document snapshot."""
-    doc = MagicMock()
+    """Helper to create a mock Firestore document snapshot exposing only the attributes handlers use."""
+    doc = Mock(spec_set=["to_dict", "get", "id", "exists", "reference"])
     doc.to_dict.return_value = data
+    doc.get.side_effect = data.__getitem__
     doc.id = doc_id
     doc.exists = True
-    doc.reference = MagicMock()
+    doc.reference = Mock(spec_set=["id", "path"])
     return doc
 
 
@@ -87,169 +128,378 @@ def create_mock_firestore_doc(data, doc_id="some-doc-id"):
 
 class TestApiHandler:
     @patch("api_handler.path_to_device")
-    @patch("api_handler._get_transaction")
+    @patch("api_handler._get_config")
     def test_get_success(
-        self, mock_get_transaction, mock_path_to_device, mock_db, app_context, sample_device, sample_config
+        self, mock_get_config, mock_path_to_device, mock_db, sample_device, sample_config
     ):
         # Arrange
         mock_path_to_device.return_value = sample_device
-        mock_get_transaction.return_value = sample_config
+        mock_get_config.return_value = sample_config
         request = create_mock_request(path=f"/{sample_device.model.value}/{sample_device.serial_number}")
 
         # Act
         response = get(request, mock_db)
+        body = response.get_json()
 
         # Assert
         mock_path_to_device.assert_called_once_with(request.path)
-        mock_db.transaction.assert_called_once()
-        mock_get_transaction.assert_called_once_with(mock_db.transaction(), mock_db, sample_device)
+        mock_db.transaction.assert_not_called()
+        mock_get_config.assert_called_once_with(mock_db, sample_device)
         assert response.status_code == HTTPStatus.OK
-        assert response.json == sample_config.to_client_dict()
-
+        assert body == sample_config.to_client_dict()
+
+    @pytest.mark.parametrize(
+        "path_error, read_error, expected_status, expected_error",
+        [
+            (None, FirestoreError("Device not found"), HTTPStatus.NOT_FOUND, "Device not found"),
+            (
+                None,
+                FirestoreError("Config document with ID config-id not found."),
+                HTTPStatus.NOT_FOUND,
+                "Config document with ID config-id not found.",
+            ),
+            (
+                None,
+                RuntimeError("connection reset"),
+                HTTPStatus.INTERNAL_SERVER_ERROR,
+                "An internal server error occurred.",
+            ),
+            (ValueError("Invalid path"), None, HTTPStatus.BAD_REQUEST, "Bad Request: Invalid path"),
+        ],
+        ids=["device_not_found", "config_not_found", "unexpected_error", "invalid_path"],
+    )
     @patch("api_handler.path_to_device")
-    @patch("api_handler._get_transaction", side_effect=FirestoreError("Device not found"))
-    def test_get_device_not_found(self, mock_get_transaction, mock_path_to_device, mock_db, app_context, sample_device):
+    @patch("api_handler._get_config")
+    def test_get_errors(
+        self,
+        mock_get_config,
+        mock_path_to_device,
+        path_error,
+        read_error,
+        expected_status,
+        expected_error,
+        mock_db,
+        sample_device,
+    ):
         # Arrange
         mock_path_to_device.return_value = sample_device
+        mock_path_to_device.side_effect = path_error
+        mock_get_config.side_effect = read_error
         request = create_mock_request(path=f"/{sample_device.model.value}/{sample_device.serial_number}")
 
         # Act
         response = get(request, mock_db)
+        body = response.get_json()
 
         # Assert
-        assert response.status_code == HTTPStatus.NOT_FOUND
-        assert "Device not found" in response.json["error"]
+        assert response.status_code == expected_status
+        assert body == {"error": expected_error}
+
+    def test_get_config_caches_config_ref(self, mock_db, firestore_collections, sample_device, sample_config):
+        # Arrange
+        mock_device_collection, mock_config_collection, _ = firestore_collections
+        _doc_ref(mock_device_collection).get.return_value = create_mock_firestore_doc(
+            {"model": "IchibuV1", "serialNumber": sample_device.serial_number, "config": "config-id"}
+        )
+        _doc_ref(mock_config_collection).get.return_value = create_mock_firestore_doc(
+            sample_config.model_dump(by_alias=True)
+        )
+
+        # Act
+        first = _get_config(mock_db, sample_device)
+        second = _get_config(mock_db, sample_device)
 
-    @patch("api_handler.path_to_device", side_effect=ValueError("Invalid path"))
-    def test_get_invalid_path(self, mock_path_to_device, mock_db, app_context):
+        # Assert
+        mock_device_collection.document.assert_called_once_with("IchibuV1-test-serial-123")
+        mock_config_collection.document.assert_called_with("config-id")
+        assert _doc_ref(mock_config_collection).get.call_count == 2
+        _doc_ref(mock_config_collection).get.assert_called_with()
+        mock_db.transaction.assert_not_called()
+        assert first == second == sample_config
+
+    def test_config_ref_cache_expires(self, mock_db, firestore_collections, sample_device):
         # Arrange
-        request = create_mock_request(path="/invalid/path/format")
+        mock_device_collection, _, _ = firestore_collections
+        _doc_ref(mock_device_collection).get.return_value = create_mock_firestore_doc(
+            {"model": "IchibuV1", "serialNumber": sample_device.serial_number, "config": "config-id"}
+        )
+        _resolve_config_ref(mock_db, sample_device)
 
         # Act
-        response = get(request, mock_db)
+        # A deleted device stops resolving once its cached reference expires.
+        _resolve_config_ref.cache.expire(time.monotonic() + _CONFIG_REF_TTL_SECONDS + 1)
+        _doc_ref(mock_device_collection).get.return_value.to_dict.return_value = None
 
         # Assert
-        assert response.status_code == HTTPStatus.BAD_REQUEST
-        assert "Invalid path" in response.json["error"]
+        with pytest.raises(FirestoreError, match="No document found"):
+            _resolve_config_ref(mock_db, sample_device)
+
+    def test_config_ref_cache_is_keyed_on_device(self, sample_device):
+        # Arrange
+        first_db, second_db = MagicMock(), MagicMock()
+        _doc_ref(first_db.collection.return_value).get.return_value = create_mock_firestore_doc(
+            {"model": "IchibuV1", "serialNumber": sample_device.serial_number, "config": "config-id"}
+        )
+
+        # Act
+        first = _resolve_config_ref(first_db, sample_device)
+        second = _resolve_config_ref(second_db, sample_device)
+
+        # Assert
+        assert first == second == "config-id"
+        second_db.collection.assert_not_called()
+        assert list(_resolve_config_ref.cache.keys()) == [hashkey(sample_device)]
+
+    def test_get_config_not_found(self, mock_db, firestore_collections, sample_device):
+        # Arrange
+        mock_device_collection, mock_config_collection, _ = firestore_collections
+        _doc_ref(mock_device_collection).get.return_value = create_mock_firestore_doc(
+            {"model": "IchibuV1", "serialNumber": sample_device.serial_number, "config": "config-id"}
+        )
+        _doc_ref(mock_config_collection).get.return_value.exists = False
 
+        # Act & Assert
+        with pytest.raises(FirestoreError, match="Config document with ID config-id not found"):
+            _get_config(mock_db, sample_device)
+
+    @pytest.mark.parametrize(
+        "config_data",
+        [{}, {"gain": 2.0, "ingredient": "sugar"}],
+        ids=["base", "changed_fields"],
+        indirect=True,
+    )
     @patch("api_handler.path_to_device")
-    @patch("api_handler._put_transaction")
-    def test_put_success(
-        self, mock_put_transaction, mock_path_to_device, mock_db, app_context, sample_device, sample_config_data
-    ):
+    @patch("api_handler._put_config")
+    def test_put_success(self, mock_put_config, mock_path_to_device, mock_db, sample_device, config_data):
         # Arrange
         mock_path_to_device.return_value = sample_device
         request = create_mock_request(
             path=f"/{sample_device.model.value}/{sample_device.serial_number}",
             method="PUT",
-            json_data=sample_config_data,
+            json_data=config_data,
         )
 
         # Act
         response = put(request, mock_db)
+        body = response.get_json()
 
         # Assert
         mock_path_to_device.assert_called_once_with(request.path)
-        mock_db.transaction.assert_called_once()
-        # The config object is created inside put(), so we check it was called with a Config instance
-        mock_put_transaction.assert_called_once()
-        call_args = mock_put_transaction.call_args[0]
-        assert isinstance(call_args[3], Config)
+        assert request.cached is False
+        mock_db.transaction.assert_not_called()
+        # The config object is created inside put(), so we check it was called with the parsed Config
+        mock_put_config.assert_called_once()
+        call_args = mock_put_config.call_args[0]
+        assert call_args[2] == Config.model_validate(config_data)
         assert response.status_code == HTTPStatus.OK
-        assert "updated successfully" in response.json["message"]
-
+        assert "updated successfully" in body["message"]
+
+    @pytest.mark.parametrize(
+        "path_error, write_error, expected_status, expected_error",
+        [
+            (None, FirestoreError("Device not found"), HTTPStatus.NOT_FOUND, "Device not found"),
+            (
+                None,
+                RuntimeError("connection reset"),
+                HTTPStatus.INTERNAL_SERVER_ERROR,
+                "An internal server error occurred.",
+            ),
+            (ValueError("Invalid path"), None, HTTPStatus.BAD_REQUEST, "Bad Request: Invalid path"),
+        ],
+        ids=["device_not_found", "unexpected_error", "invalid_path"],
+    )
     @patch("api_handler.path_to_device")
-    def test_put_invalid_json(self, mock_path_to_device, mock_db, app_context, sample_device):
+    @patch("api_handler._put_config")
+    def test_put_errors(
+        self,
+        mock_put_config,
+        mock_path_to_device,
+        path_error,
+        write_error,
+        expected_status,
+        expected_error,
+        mock_db,
+        sample_device,
+        config_data,
+    ):
         # Arrange
         mock_path_to_device.return_value = sample_device
+        mock_path_to_device.side_effect = path_error
+        mock_put_config.side_effect = write_error
         request = create_mock_request(
             path=f"/{sample_device.model.value}/{sample_device.serial_number}",
             method="PUT",
-            json_data={"invalid": "data"},
+            json_data=config_data,
         )
 
         # Act
         response = put(request, mock_db)
+        body = response.get_json()
 
         # Assert
-        assert response.status_code == HTTPStatus.BAD_REQUEST
-        assert "Bad Request" in response.json["error"]
+        assert response.status_code == expected_status
+        assert body == {"error": expected_error}
+
+    def test_put_config_writes_cached_config_ref(self, mock_db, firestore_collections, sample_device, sample_config):
+        # Arrange
+        mock_device_collection, mock_config_collection, _ = firestore_collections
+        _doc_ref(mock_device_collection).get.return_value = create_mock_firestore_doc(
+            {"model": "IchibuV1", "serialNumber": sample_device.serial_number, "config": "config-id"}
+        )
+
+        # Act
+        _put_config(mock_db, sample_device, sample_config)
+        _put_config(mock_db, sample_device, sample_config)
+
+        # Assert
+        _doc_ref(mock_device_collection).get.assert_called_once_with()
+        mock_config_collection.document.assert_called_with("config-id")
+        _doc_ref(mock_config_collection).set.assert_called_with(sample_config.model_dump(by_alias=True))
 
     @patch("api_handler._post_transaction")
-    def test_post_success(self, mock_post_transaction, mock_db, app_context, sample_config_data, sample_device):
+    def test_post_success(self, mock_post_transaction, mock_db, config_data, sample_device):
         # Arrange
         mock_post_transaction.return_value = sample_device
-        request = create_mock_request(path=f"/{Model.IchibuV1.value}", method="POST", json_data=sample_config_data)
+        request = create_mock_request(path=f"/{Model.IchibuV1.value}", method="POST", json_data=config_data)
 
         # Act
         response = post(request, mock_db)
+        body = response.get_json()
 
         # Assert
         mock_db.transaction.assert_called_once()
         mock_post_transaction.assert_called_once()
         assert response.status_code == HTTPStatus.CREATED
-        assert response.json == sample_device.model_dump()
+        assert body == sample_device.model_dump()
+
+    def test_post_invalid_model(self, mock_db, config_data):
+        # Arrange
+        request = create_mock_request(path="/NotAModel", method="POST", json_data=config_data)
+
+        # Act
+        response = post(request, mock_db)
+        body = response.get_json()
+
+        # Assert
+        mock_db.transaction.assert_not_called()
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert "Invalid model 'NotAModel'" in body["error"]
+
+    @pytest.mark.parametrize(
+        "transaction_error, expected_status, expected_error",
+        [
+            (
+                AlreadyExists("Document already exists"),
+                HTTPStatus.CONFLICT,
+                "Conflict: The allocated serial number is already in use.",
+            ),
+            (RuntimeError("connection reset"), HTTPStatus.INTERNAL_SERVER_ERROR, "An internal server error occurred."),
+        ],
+        ids=["serial_number_conflict", "unexpected_error"],
+    )
+    @patch("api_handler._post_transaction")
+    def test_post_errors(
+        self, mock_post_transaction, transaction_error, expected_status, expected_error, mock_db, config_data
+    ):
+        # Arrange
+        mock_post_transaction.side_effect = transaction_error
+        request = create_mock_request(path=f"/{Model.IchibuV1.value}", method="POST", json_data=config_data)
+
+        # Act
+        response = post(request, mock_db)
+        body = response.get_json()
 
-    def test_post_transaction_no_collision(self, mock_db, sample_config):
+        # Assert
+        assert response.status_code == expected_status
+        assert body == {"error": expected_error}
+
+    @pytest.mark.parametrize(
+        "taken_suffixes, expected_suffix, expected_count",
+        [
+            ([], "", 1),
+            ([""], "-0", 2),
+            (["", "-0"], "-1", 3),
+            (["", "-1"], "-2", 4),
+            (["", "-29"], "-30", 32),
+        ],
+        ids=["no_collision", "serial_collision", "two_collisions", "gap", "gap_across_batches"],
+    )
+    def test_post_transaction_without_counter(
+        self, taken_suffixes, expected_suffix, expected_count, mock_db, firestore_collections, sample_config
+    ):
         # Arrange
         transaction = MagicMock()
         model = Model.IchibuV1
         base_serial = f"{sample_config.phidget_id}-{sample_config.load_cell_id}"
 
-        mock_device_collection = MagicMock()
-        mock_config_collection = MagicMock()
-        mock_db.collection.side_effect = lambda name: {
-            DEVICE_COLLECTION: mock_device_collection,
-            CONFIG_COLLECTION: mock_config_collection,
-        }[name]
-
-        mock_query = MagicMock()
-        mock_device_collection.where.return_value = mock_query
-        mock_query.stream.return_value = []  # No collision
+        mock_device_collection, mock_config_collection, mock_counter_collection = firestore_collections
+        _doc_ref(mock_config_collection).id = "new-config-id"
+        _doc_ref(mock_counter_collection).get.return_value.exists = False  # No counter yet
+        _doc_ref(mock_device_collection).get.return_value.exists = False  # Claimed serial number is free
 
-        mock_config_doc_ref = MagicMock()
-        mock_config_doc_ref.id = "new-config-id"
-        mock_config_collection.document.return_value = mock_config_doc_ref
-        mock_device_collection.document.return_value = MagicMock()
+        _serial_number_query(mock_device_collection).stream.return_value = [
+            create_mock_firestore_doc({"serialNumber": base_serial + suffix}) for suffix in taken_suffixes
+        ]
 
         # Act
         new_device = _post_transaction(transaction, mock_db, model, sample_config)
 
         # Assert
-        mock_device_collection.where.assert_called_once()
-        assert mock_device_collection.where.call_args[1]["filter"].value == base_serial
-        assert new_device.serial_number == base_serial
-
-    def test_post_transaction_serial_collision(self, mock_db, sample_config):
+        serial_filter = mock_device_collection.where.call_args_list[0][1]["filter"]
+        assert serial_filter.op_string == "in"
+        assert serial_filter.value[:3] == [base_serial, f"{base_serial}-0", f"{base_serial}-1"]
+        assert new_device.serial_number == base_serial + expected_suffix
+        mock_device_collection.document.assert_called_with(f"{model.value}-{base_serial}{expected_suffix}")
+        transaction.set.assert_called_once_with(_doc_ref(mock_counter_collection), {"count": expected_count})
+        # New documents are created, never set, so a taken ID fails the commit instead of overwriting.
+        transaction.create.assert_any_call(_doc_ref(mock_device_collection), ANY)
+        transaction.create.assert_any_call(_doc_ref(mock_config_collection), ANY)
+
+    def test_post_transaction_existing_counter(self, mock_db, firestore_collections, sample_config):
         # Arrange
         transaction = MagicMock()
         model = Model.IchibuV1
         base_serial = f"{sample_config.phidget_id}-{sample_config.load_cell_id}"
 
-        mock_device_collection = MagicMock()
-        mock_config_collection = MagicMock()
-        mock_db.collection.side_effect = lambda name: {
-            DEVICE_COLLECTION: mock_device_collection,
-            CONFIG_COLLECTION: mock_config_collection,
-        }[name]
+        mock_device_collection, mock_config_collection, mock_counter_collection = firestore_collections
+        _doc_ref(mock_config_collection).id = "new-config-id"
+        mock_counter_ref = _doc_ref(mock_counter_collection)
+        mock_counter_ref.get.return_value = create_mock_firestore_doc({"count": 3})
+        _doc_ref(mock_device_collection).get.return_value.exists = False  # Claimed serial number is free
 
-        mock_query = MagicMock()
-        mock_device_collection.where.return_value = mock_query
-        mock_query.stream.side_effect = [[create_mock_firestore_doc({})], []]  # Collision, then no collision
+        # Act
+        new_device = _post_transaction(transaction, mock_db, model, sample_config)
 
-        mock_config_doc_ref = MagicMock()
-        mock_config_doc_ref.id = "new-config-id"
-        mock_config_collection.document.return_value = mock_config_doc_ref
-        mock_device_collection.document.return_value = MagicMock()
+        # Assert
+        mock_counter_collection.document.assert_called_once_with(base_serial)
+        mock_device_collection.where.assert_not_called()
+        transaction.set.assert_any_call(mock_counter_ref, {"count": 4})
+        assert new_device.serial_number == f"{base_serial}-2"
+
+    def test_post_transaction_stale_counter_reprobes(self, mock_db, firestore_collections, sample_config):
+        # Arrange
+        transaction = MagicMock()
+        model = Model.IchibuV1
+        base_serial = f"{sample_config.phidget_id}-{sample_config.load_cell_id}"
+
+        mock_device_collection, mock_config_collection, mock_counter_collection = firestore_collections
+        _doc_ref(mock_config_collection).id = "new-config-id"
+        mock_counter_ref = _doc_ref(mock_counter_collection)
+        mock_counter_ref.get.return_value = create_mock_firestore_doc({"count": 2})
+        # The counter points at "-1", which was registered without it; "-0" was deleted.
+        _doc_ref(mock_device_collection).get.return_value.exists = True
+        _serial_number_query(mock_device_collection).stream.return_value = [
+            create_mock_firestore_doc({"serialNumber": base_serial + suffix}) for suffix in ["", "-1"]
+        ]
 
         # Act
         new_device = _post_transaction(transaction, mock_db, model, sample_config)
 
         # Assert
-        assert len(mock_device_collection.where.call_args_list) == 2
-        assert mock_device_collection.where.call_args_list[0][1]["filter"].value == base_serial
-        assert mock_device_collection.where.call_args_list[1][1]["filter"].value == f"{base_serial}-0"
-        assert new_device.serial_number == f"{base_serial}-0"
+        mock_device_collection.document.assert_any_call(f"{model.value}-{base_serial}-1")
+        assert new_device.serial_number == f"{base_serial}-2"
+        transaction.set.assert_called_once_with(mock_counter_ref, {"count": 4})
+        transaction.create.assert_any_call(_doc_ref(mock_device_collection), ANY)
 
 
 # --- Tests for address_api_handler.py ---
@@ -258,7 +508,7 @@ class TestApiHandler:
 class TestAddressApiHandler:
     @patch("address_api_handler.path_to_device")
     @patch("address_api_handler._get_address_transaction")
-    def test_get_address_success(self, mock_get_address, mock_path_to_device, mock_db, app_context, sample_device):
+    def test_get_address_success(self, mock_get_address, mock_path_to_device, mock_db, sample_device):
         # Arrange
         mock_path_to_device.return_value = sample_device
         expected_address = "192.168.1.100"
@@ -267,47 +517,81 @@ class TestAddressApiHandler:
 
         # Act
         response = get_address(request, mock_db)
+        body = response.get_json()
 
         # Assert
         mock_path_to_device.assert_called_once_with(f"/{sample_device.model.value}/{sample_device.serial_number}")
         mock_db.transaction.assert_called_once()
         mock_get_address.assert_called_once_with(mock_db.transaction(), mock_db, sample_device)
         assert response.status_code == HTTPStatus.OK
-        assert response.json == {"address": expected_address}
-
+        assert body == {"address": expected_address}
+
+    @pytest.mark.parametrize(
+        "path_error, transaction_error, expected_status, expected_error",
+        [
+            (None, FirestoreError("Device not found"), HTTPStatus.NOT_FOUND, "Device not found"),
+            (ValueError("Invalid path"), None, HTTPStatus.BAD_REQUEST, "Bad Request: Invalid path"),
+        ],
+        ids=["device_not_found", "invalid_path"],
+    )
     @patch("address_api_handler.path_to_device")
-    @patch("address_api_handler._get_address_transaction", side_effect=FirestoreError("Device not found"))
-    def test_get_address_not_found(self, mock_get_address, mock_path_to_device, mock_db, app_context, sample_device):
+    @patch("address_api_handler._get_address_transaction")
+    def test_get_address_errors(
+        self,
+        mock_get_address,
+        mock_path_to_device,
+        path_error,
+        transaction_error,
+        expected_status,
+        expected_error,
+        mock_db,
+        sample_device,
+    ):
         # Arrange
         mock_path_to_device.return_value = sample_device
+        mock_path_to_device.side_effect = path_error
+        mock_get_address.side_effect = transaction_error
         request = create_mock_request(path=f"/address/{sample_device.model.value}/{sample_device.serial_number}")
 
         # Act
         response = get_address(request, mock_db)
+        body = response.get_json()
 
         # Assert
-        assert response.status_code == HTTPStatus.NOT_FOUND
-        assert "Device not found" in response.json["error"]
+        assert response.status_code == expected_status
+        assert body == {"error": expected_error}
 
     def test_get_address_transaction_no_address_field(self, mock_db, sample_device):
         # Arrange
         transaction = MagicMock()
         mock_doc = create_mock_firestore_doc({"some_other_field": "value"})  # No 'address' field
-        mock_query = MagicMock()
-        mock_query.stream.return_value = [mock_doc]
-        mock_db.collection.return_value.where.return_value.where.return_value.limit.return_value = mock_query
+        mock_doc_ref = _doc_ref(mock_db.collection.return_value)
+        mock_doc_ref.get.return_value = mock_doc
 
         # Act & Assert
         with pytest.raises(FirestoreError, match="Device has no configured address"):
             _get_address_transaction(transaction, mock_db, sample_device)
-        mock_query.stream.assert_called_once_with(transaction=transaction)
+        mock_db.collection.return_value.document.assert_called_once_with("IchibuV1-test-serial-123")
+        mock_doc_ref.get.assert_called_once_with(transaction=transaction)
+
+    def test_get_address_transaction_device_not_found(self, mock_db, sample_device):
+        # Arrange
+        transaction = MagicMock()
+        mock_doc = create_mock_firestore_doc({})
+        mock_doc.exists = False
+        mock_doc.to_dict.return_value = None
+        _doc_ref(mock_db.collection.return_value).get.return_value = mock_doc
+
+        # Act & Assert
+        with pytest.raises(FirestoreError, match="No document found"):
+            _get_address_transaction(transaction, mock_db, sample_device)
 
     @patch("address_api_handler.path_to_device")
-    @patch("address_api_handler._put_address_transaction")
-    def test_put_address_success(self, mock_put_address, mock_path_to_device, mock_db, app_context, sample_device):
+    def test_put_address_success(self, mock_path_to_device, mock_db, sample_device):
         # Arrange
         mock_path_to_device.return_value = sample_device
         new_address = "192.168.1.200"
+        mock_doc_ref = _doc_ref(mock_db.collection.return_value)
         request = create_mock_request(
             path=f"/address/{sample_device.model.value}/{sample_device.serial_number}",
             method="PUT",
@@ -319,24 +603,93 @@ class TestAddressApiHandler:
 
         # Assert
         mock_path_to_device.assert_called_once_with(f"/{sample_device.model.value}/{sample_device.serial_number}")
-        mock_db.transaction.assert_called_once()
-        mock_put_address.assert_called_once_with(mock_db.transaction(), mock_db, sample_device, new_address)
+        mock_db.transaction.assert_not_called()
+        mock_db.collection.return_value.document.assert_called_once_with("IchibuV1-test-serial-123")
+        mock_doc_ref.get.assert_not_called()
+        mock_doc_ref.update.assert_called_once_with({"address": new_address})
         assert response.status_code == HTTPStatus.OK
         assert response.get_data(as_text=True) == "Successfully updated address."
 
+    @pytest.mark.parametrize(
+        "path_error, update_error, expected_status, expected_error",
+        [
+            (
+                None,
+                NotFound("No document to update"),
+                HTTPStatus.NOT_FOUND,
+                "No document found with serial number IchibuV1-test-serial-123 in collection 'devices'.",
+            ),
+            (
+                None,
+                RuntimeError("connection reset"),
+                HTTPStatus.INTERNAL_SERVER_ERROR,
+                "An internal server error occurred.",
+            ),
+            (ValueError("Invalid path"), None, HTTPStatus.BAD_REQUEST, "Bad Request: Invalid path"),
+        ],
+        ids=["device_not_found", "unexpected_error", "invalid_path"],
+    )
     @patch("address_api_handler.path_to_device")
-    def test_put_address_invalid_json(self, mock_path_to_device, mock_db, app_context, sample_device):
+    def test_put_address_errors(
+        self,
+        mock_path_to_device,
+        path_error,
+        update_error,
+        expected_status,
+        expected_error,
+        mock_db,
+        sample_device,
+    ):
         # Arrange
         mock_path_to_device.return_value = sample_device
+        mock_path_to_device.side_effect = path_error
+        _doc_ref(mock_db.collection.return_value).update.side_effect = update_error
         request = create_mock_request(
             path=f"/address/{sample_device.model.value}/{sample_device.serial_number}",
             method="PUT",
-            json_data={"wrong_key": "value"},
+            json_data={"address": "192.168.1.200"},
         )
 
         # Act
         response = put_address(request, mock_db)
+        body = response.get_json()
+
+        # Assert
+        assert response.status_code == expected_status
+        assert body == {"error": expected_error}
+
+
+# --- Tests shared by both handler modules ---
+
+
+class TestInvalidJsonBody:
+    @pytest.mark.parametrize(
+        "handler, path, request_body, expected_error",
+        [
+            (put, "/IchibuV1/test-serial-123", orjson.dumps({"invalid": "data"}), "Bad Request"),
+            (put, "/IchibuV1/test-serial-123", b"{not json", "Bad Request: Invalid JSON body"),
+            (post, "/IchibuV1", orjson.dumps({"gain": 1.0}), "Bad Request: Invalid JSON body"),
+            (post, "/IchibuV1", b"{not json", "Bad Request: Invalid JSON body"),
+            (
+                put_address,
+                "/address/IchibuV1/test-serial-123",
+                orjson.dumps({"wrong_key": "value"}),
+                "Invalid JSON body",
+            ),
+            (put_address, "/address/IchibuV1/test-serial-123", b"{not json", "Invalid JSON body"),
+        ],
+        ids=["put", "put_malformed", "post", "post_malformed", "put_address", "put_address_malformed"],
+    )
+    def test_invalid_json_body(self, handler, path, request_body, expected_error, mock_db):
+        # Arrange
+        request = create_mock_request(path=path, method="POST" if handler is post else "PUT")
+        request.data = request_body
+
+        # Act
+        response = handler(request, mock_db)
+        body = response.get_json()
 
         # Assert
+        mock_db.transaction.assert_not_called()
         assert response.status_code == HTTPStatus.BAD_REQUEST
-        assert "Invalid JSON body" in response.json["error"]
\ No newline at end of file
+        assert expected_error in body["error"]
@@ -0,0 +1,134 @@
+import importlib
+
+import pytest
+from unittest.mock import MagicMock, patch
+
+import main
+from main import _get_db, authenticate, mise
+
+# --- Fixtures ---
+
+
+@pytest.fixture(autouse=True)
+def expected_token(monkeypatch):
+    """Configures the token the server expects for every test."""
+    monkeypatch.setattr(main, "_EXPECTED_TOKEN", b"secret-token")
+
+
+# --- Helper Functions ---
+
+
+def create_mock_request(authorization=None, path="/", method="GET"):
+    """Helper to create a mock Flask request with an optional Authorization header."""
+    req = MagicMock()
+    req.headers = {} if authorization is None else {"Authorization": authorization}
+    req.path = path
+    req.method = method
+    return req
+
+
+# --- Tests for main.py ---
+
+
+class TestAuthenticate:
+    def test_authenticate_success(self):
+        # Act
+        is_authenticated, error = authenticate(create_mock_request("Bearer secret-token"))
+
+        # Assert
+        assert is_authenticated
+        assert error is None
+
+    @pytest.mark.parametrize("authorization", [None, "secret-token", "Basic secret-token"])
+    def test_authenticate_missing_header(self, authorization):
+        # Act
+        is_authenticated, error = authenticate(create_mock_request(authorization))
+
+        # Assert
+        assert not is_authenticated
+        assert error[1] == 401
+
+    def test_authenticate_invalid_token(self):
+        # Act
+        is_authenticated, error = authenticate(create_mock_request("Bearer wrong-token"))
+
+        # Assert
+        assert not is_authenticated
+        assert error[1] == 403
+
+    def test_authenticate_not_configured(self, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(main, "_EXPECTED_TOKEN", b"")
+
+        # Act
+        is_authenticated, error = authenticate(create_mock_request("Bearer secret-token"))
+
+        # Assert
+        assert not is_authenticated
+        assert error[1] == 500
+
+
+class TestGetDb:
+    @patch("main.firestore.Client")
+    def test_get_db_reuses_client(self, mock_client, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(main, "_DB", None)
+
+        # Act
+        first = _get_db()
+        second = _get_db()
+
+        # Assert
+        mock_client.assert_called_once_with(project="back-of-house-backend", database="caldo-backend")
+        assert first is second
+
+    @patch("google.cloud.firestore.Client")
+    def test_db_warmed_at_import_on_deployed_instance(self, mock_client, monkeypatch):
+        # Arrange
+        monkeypatch.setenv("K_SERVICE", "mise")
+        monkeypatch.setattr(main, "_DB", None)
+
+        # Act
+        importlib.reload(main)
+
+        # Assert
+        mock_client.assert_called_once_with(project="back-of-house-backend", database="caldo-backend")
+        assert main._DB is mock_client.return_value
+
+
+class TestMise:
+    @pytest.mark.parametrize(
+        "path, method, table",
+        [
+            ("/IchibuV1/test-serial-123", "GET", "_HANDLERS"),
+            ("/IchibuV1", "POST", "_HANDLERS"),
+            ("/IchibuV1/test-serial-123", "PUT", "_HANDLERS"),
+            ("/address/IchibuV1/test-serial-123", "GET", "_ADDRESS_HANDLERS"),
+            ("/address/IchibuV1/test-serial-123", "PUT", "_ADDRESS_HANDLERS"),
+        ],
+    )
+    def test_mise_routes_by_method(self, path, method, table, monkeypatch):
+        # Arrange
+        mock_db = MagicMock()
+        mock_handler = MagicMock()
+        monkeypatch.setattr(main, "_DB", mock_db)
+        monkeypatch.setitem(getattr(main, table), method, mock_handler)
+        request = create_mock_request("Bearer secret-token", path, method)
+
+        # Act
+        response = mise(request)
+
+        # Assert
+        mock_handler.assert_called_once_with(request, mock_db)
+        assert response is mock_handler.return_value
+
+    def test_mise_unrouted_method(self, monkeypatch):
+        # Arrange
+        monkeypatch.setattr(main, "_DB", MagicMock())
+        request = create_mock_request("Bearer secret-token", "/address/IchibuV1/test-serial-123", "POST")
+
+        # Act
+        response = mise(request)
+
+        # Assert
+        assert response.get_data(as_text=True) == "Hello, Chef!"
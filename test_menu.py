@@ -0,0 +1,151 @@
+import pytest
+from unittest.mock import MagicMock
+
+from pydantic import ValidationError
+from pydantic_core import SchemaSerializer, SchemaValidator
+
+from menu import (
+    Config,
+    Device,
+    FirestoreDeviceDocument,
+    FirestoreError,
+    Model,
+    path_to_device,
+    query_for_device,
+)
+
+# --- Tests for menu.py ---
+
+
+@pytest.mark.parametrize("model", [Config, Device, FirestoreDeviceDocument])
+def test_models_are_built_at_import(model):
+    # Cold starts should not pay for schema building on the first request.
+    assert model.__pydantic_complete__
+    assert isinstance(model.__pydantic_validator__, SchemaValidator)
+    assert isinstance(model.__pydantic_serializer__, SchemaSerializer)
+
+
+class TestDevice:
+    def test_device_is_hashable(self):
+        # Act
+        first = Device(model=Model.IchibuV1, serial_number="test-serial-123")
+        second = Device(model=Model.IchibuV1, serial_number="test-serial-123")
+
+        # Assert
+        assert hash(first) == hash(second)
+
+    def test_device_rejects_extra_fields(self):
+        # Act & Assert
+        with pytest.raises(ValidationError):
+            Device(model=Model.IchibuV1, serial_number="test-serial-123", config="x")
+
+    def test_firestore_device_document_allows_address(self):
+        # Act
+        device_document = FirestoreDeviceDocument.model_validate(
+            {
+                "model": "IchibuV1",
+                "serialNumber": "test-serial-123",
+                "config": "config-id",
+                "address": "10.0.0.1",
+            }
+        )
+
+        # Assert
+        assert device_document.to_config_ref() == "config-id"
+
+
+class TestConfig:
+    def test_to_client_dict_splits_durations(self):
+        # Arrange
+        config = Config.model_validate(
+            {
+                "gain": 1.0,
+                "ingredient": "Test Ingredient",
+                "loadCellId": 1,
+                "location": "Test Location",
+                "offset": 0.5,
+                "phidgetId": 12345,
+                "heartbeatPeriod": {"secs": 30, "nanos": 0},
+                "phidgetSamplePeriod": 0.1,
+                "maxNoise": 0.1,
+                "bufferLength": 10,
+            }
+        )
+
+        # Act
+        client_dict = config.to_client_dict()
+
+        # Assert
+        assert client_dict["heartbeat_period"] == {"secs": 30, "nanos": 0}
+        assert client_dict["phidget_sample_period"] == {"secs": 0, "nanos": 100_000_000}
+        assert client_dict["load_cell_id"] == 1
+
+
+class TestPathToDevice:
+    @pytest.mark.parametrize(
+        "path",
+        [
+            "/IchibuV1/test-serial-123",
+            "/IchibuV1/test-serial-123/",
+        ],
+    )
+    def test_path_to_device_success(self, path):
+        # Act
+        device = path_to_device(path)
+
+        # Assert
+        assert device == Device(model=Model.IchibuV1, serial_number="test-serial-123")
+
+    def test_path_to_device_is_cached(self):
+        # Act
+        first = path_to_device("/IchibuV2/cached-serial")
+        second = path_to_device("/IchibuV2/cached-serial")
+
+        # Assert
+        assert first is second
+
+    @pytest.mark.parametrize(
+        "path", ["/IchibuV1", "/IchibuV1/a/b", "/address/IchibuV1", "/address/IchibuV1/test-serial-123", "/", ""]
+    )
+    def test_path_to_device_invalid_format(self, path):
+        # Act & Assert
+        with pytest.raises(ValueError, match="Invalid path format"):
+            path_to_device(path)
+
+    def test_path_to_device_invalid_model(self):
+        # Act & Assert
+        with pytest.raises(ValueError, match="Invalid model 'NotAModel'"):
+            path_to_device("/NotAModel/test-serial-123")
+
+
+class TestQueryForDevice:
+    def test_query_for_device_reads_by_document_id(self, mock_db):
+        # Arrange
+        device = Device(model=Model.IchibuV1, serial_number="test-serial-123")
+        mock_doc = MagicMock()
+        mock_doc.exists = True
+        mock_doc.to_dict.return_value = {
+            "model": "IchibuV1",
+            "serialNumber": "test-serial-123",
+            "config": "config-id",
+        }
+        mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
+
+        # Act
+        device_document = query_for_device(device, mock_db)
+
+        # Assert
+        mock_db.collection.return_value.document.assert_called_once_with("IchibuV1-test-serial-123")
+        assert device_document.to_device() == device
+        assert device_document.to_config_ref() == "config-id"
+
+    def test_query_for_device_not_found(self, mock_db):
+        # Arrange
+        device = Device(model=Model.IchibuV1, serial_number="test-serial-123")
+        mock_snapshot = mock_db.collection.return_value.document.return_value.get.return_value
+        mock_snapshot.exists = False
+        mock_snapshot.to_dict.return_value = None
+
+        # Act & Assert
+        with pytest.raises(FirestoreError, match="No document found"):
+            query_for_device(device, mock_db)